@@ -66,23 +66,42 @@ def test_rag(question):
     
     try:
         start_time = datetime.now()
-        result = rag_basic.rag_query(question, model=QWEN_MODEL)
-        end_time = datetime.now()
-        duration = (end_time - start_time).total_seconds()
+        result = rag_basic.rag_query(question, model=QWEN_MODEL, stream=True)
         
-        print(f"⏱️  耗时: {duration:.2f} 秒\n")
         print("回答:")
         print("-" * 70)
-        print(result["answer"])
+        answer = result["answer"]
+        first_token_time = None
+        if isinstance(answer, str):
+            # 未检索到文档或查询失败时返回的是完整字符串
+            print(answer)
+        else:
+            # 流式输出：边生成边打印，用户无需等待完整回答
+            parts = []
+            for token in answer:
+                if first_token_time is None:
+                    first_token_time = (datetime.now() - start_time).total_seconds()
+                sys.stdout.write(token)
+                sys.stdout.flush()
+                parts.append(token)
+            print()
+            answer = "".join(parts)
         print("-" * 70)
         
+        end_time = datetime.now()
+        duration = (end_time - start_time).total_seconds()
+        if first_token_time is not None:
+            print(f"⏱️  耗时: {duration:.2f} 秒（首字延迟: {first_token_time:.2f} 秒）")
+        else:
+            print(f"⏱️  耗时: {duration:.2f} 秒")
+        
         if result["sources"]:
             print("\n📚 引用来源:")
             for src in result["sources"]:
                 print(f"  - {src}")
         
         return {
-            "answer": result["answer"],
+            "answer": answer,
             "duration": duration,
             "sources": result["sources"]
         }
@@ -1,13 +1,34 @@
 import os
 import json
+import asyncio
 import requests
-from openai import OpenAI
+import httpx
+from functools import lru_cache
+from openai import OpenAI, AsyncOpenAI
 
-def chat_qwen(prompt, model, stream=False):
-    client = OpenAI(
+MAX_CONCURRENCY = 8  # 批量调用时同时在途的请求上限
+
+@lru_cache(maxsize=1)
+def get_client():
+    """
+    进程内共享的 OpenAI 客户端（首次调用时创建）
+
+    复用同一个 httpx 连接池，保持 keep-alive / HTTP/2 连接，
+    避免每次请求都重新进行 TCP + TLS 握手。
+    """
+    http_client = httpx.Client(
+        http2=True,
+        timeout=30,
+        limits=httpx.Limits(max_keepalive_connections=20),
+    )
+    return OpenAI(
         api_key=os.environ.get('QWEN_API_KEY'),
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+        http_client=http_client,
     )
+
+def chat_qwen(prompt, model, stream=False):
+    client = get_client()
     print("----- qwen request start -----")
 
     completion = client.chat.completions.create(
@@ -34,6 +55,34 @@ def chat_qwen(prompt, model, stream=False):
         print(e)
         return "fail to response"
 
+async def achat_qwen(prompts, model):
+    """
+    并发调用多个提示词（例如重排序时给多个候选片段打分），按输入顺序返回回答列表
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    # 异步客户端与事件循环绑定，因此每次批量调用单独创建并在结束时关闭
+    async with AsyncOpenAI(
+        api_key=os.environ.get('QWEN_API_KEY'),
+        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+    ) as client:
+        async def _one(prompt):
+            async with semaphore:
+                completion = await client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": "You are a helpful assistant"},
+                        {"role": "user", "content": prompt},
+                    ],
+                    temperature=0.1,
+                )
+            return completion.choices[0].message.content
+
+        return await asyncio.gather(*[_one(p) for p in prompts])
+
+def chat_qwen_batch(prompts, model):
+    """achat_qwen 的同步封装"""
+    return asyncio.run(achat_qwen(prompts, model))
+
 if __name__ == '__main__':
     import os
     
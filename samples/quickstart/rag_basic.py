@@ -10,11 +10,25 @@
 
 import os
 import sys
-from glob import glob
+import asyncio
+import hashlib
+import queue
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from openai import OpenAI
-from langchain_community.embeddings import DashScopeEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import Chroma
 
+try:
+    from numba import njit   #! 可选依赖：uv add numba，未安装时自动退化为纯 Python
+except ImportError:
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
 # -----------------------
 # 配置区
 # -----------------------
@@ -23,25 +37,53 @@ PERSIST_DIR = "chroma_db"       # chroma 持久化目录
 CHUNK_SIZE = 500                # 切片大小（字符）
 CHUNK_OVERLAP = 100             # 切片重叠（字符）
 TOP_K = 3                       # 检索 top-k 值
+INSERT_BATCH_SIZE = 200         # 向量库批量写入大小（建议 50~250）
+READ_WORKERS = 8                # 并发读取文档的线程数
+EMBED_WORKERS = 8               # 并发向量化的线程数
+EMBED_QUEUE_SIZE = 4            # 向量化结果队列长度（限制内存中待写入的批次数）
+EMBED_MODEL = "text-embedding-v4"  # Embedding 模型名
+EMBED_API_BATCH = 10               # Embedding 接口单次请求最多 10 条
+EMB_CACHE_FILE = "emb_cache.npz"   # 片段向量缓存（按内容哈希复用，重建向量库时只需向量化变化的片段）
+# Chroma HNSW 索引参数：M/construction_ef 影响建库质量，search_ef 越小查询越快（召回略降）
+HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 16,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64,
+}
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma").lower()  # 向量库后端：chroma / faiss
+FAISS_PERSIST_DIR = "faiss_db"  # faiss 持久化目录
 QWEN_MODEL = "qwen3-max"        # qwen 模型名，按实际替换
 
 # -----------------------
 # 1) 读取所有文档
 # -----------------------
 try:
-    file_paths = glob(os.path.join(DATA_DIR, "*.md")) + glob(os.path.join(DATA_DIR, "*.txt"))
+    # 只扫描一次目录（os.scandir 直接带回文件类型，无需逐个 stat）
+    with os.scandir(DATA_DIR) as entries:
+        file_paths = sorted(
+            e.path for e in entries
+            if e.is_file() and e.name.lower().endswith((".md", ".txt"))
+        )
     if not file_paths:
         raise FileNotFoundError(f"请在 {DATA_DIR}/ 目录放入示例 .md 或 .txt 文件（UTF-8 编码）")
 except Exception as e:
     print(f"❌ 错误：无法读取文档目录 - {e}")
     sys.exit(1)
 
+def _read_doc(p):
+    # 使用 UTF-8 编码读取文件，若文件不是 UTF-8 请先转码
+    with open(p, "r", encoding="utf-8") as f:
+        return f.read()
+
+# 多线程并发读取，文件 I/O 等待相互重叠；结果按 file_paths 顺序处理
+with ThreadPoolExecutor(max_workers=READ_WORKERS) as ex:
+    futures = [ex.submit(_read_doc, p) for p in file_paths]
+
 raw_docs = []
-for p in file_paths:
+for p, fut in zip(file_paths, futures):
     try:
-        # 使用 UTF-8 编码读取文件，若文件不是 UTF-8 请先转码
-        with open(p, "r", encoding="utf-8") as f:
-            text = f.read()
+        text = fut.result()
         if not text.strip():
             print(f"⚠️  警告：文件 {p} 为空，已跳过")
             continue
@@ -63,34 +105,166 @@ if not raw_docs:
 chunks = []      # 存储所有文本片段（字符串）
 metadatas = []   # 与 chunks 对应的元数据（例如来源文件名、片段序号）
 
-for doc in raw_docs:
-    txt = doc["text"]
-    start = 0
+@njit(cache=True)
+def emit_offsets(lens, chunk_size, overlap, out):
+    """
+    一次性计算整个语料的切片位置，写入 out 的每一行 (文档序号, 起点, 终点)，返回片段总数
+    
+    起点只取到 len - 重叠（首个片段除外），避免末尾产生被上一片段完全覆盖的片段。
+    """
+    stride = chunk_size - overlap  # 相邻片段起点的间距
     idx = 0
-    while start < len(txt):
-        end = min(start + CHUNK_SIZE, len(txt))  # 确保不越界
-        chunk_text = txt[start:end].strip()  # 去除首尾空白
-        
-        # 跳过空片段
-        if not chunk_text:
-            break
-            
-        # 记录来源和片段索引，便于追溯
-        meta = {"source": doc["source"], "chunk_index": idx}
-        chunks.append(chunk_text)
-        metadatas.append(meta)
-        idx += 1
-        
-        # 下一个片段起始位置（包含重叠，避免重复）
-        start = end - CHUNK_OVERLAP if end - CHUNK_OVERLAP > start else end
-        if start >= len(txt):  # 防止无限循环
-            break
+    for d in range(lens.size):
+        s = 0
+        while s == 0 or s < lens[d] - overlap:
+            out[idx, 0] = d
+            out[idx, 1] = s
+            out[idx, 2] = min(s + chunk_size, lens[d])  # 确保不越界
+            idx += 1
+            s += stride
+    return idx
+
+lens = np.array([len(doc["text"]) for doc in raw_docs], dtype=np.int64)
+out = np.empty((int((lens // (CHUNK_SIZE - CHUNK_OVERLAP) + 1).sum()), 3), dtype=np.int64)
+n = emit_offsets(lens, CHUNK_SIZE, CHUNK_OVERLAP, out)
+
+next_index = [0] * len(raw_docs)  # 每个文档下一个片段的序号
+for d, s, e in out[:n].tolist():
+    # 切片并去除首尾空白，跳过空片段（strip() 无空白可去时直接返回原对象，不会额外分配）
+    chunk_text = raw_docs[d]["text"][s:e].strip()
+    if not chunk_text:
+        continue
+    # 记录来源和片段索引，便于追溯
+    chunks.append(chunk_text)
+    metadatas.append({"source": raw_docs[d]["source"], "chunk_index": next_index[d]})
+    next_index[d] += 1
 
 print(f"✅ 已读取 {len(raw_docs)} 个文档，切分为 {len(chunks)} 个片段。")
 
 # -----------------------
 # 3) Embedding -> 写入 Chroma（向量化并存储）
 # -----------------------
+# Embedding 与 LLM 调用复用 only_llm.py 中的共享客户端（连接池 + keep-alive）
+try:
+    from only_llm import chat_qwen, get_client
+except ImportError:
+    print("❌ 错误：无法导入 only_llm 模块，请确保 only_llm.py 文件存在")
+    sys.exit(1)
+
+class QwenEmbeddings(Embeddings):
+    """
+    千问 Embedding 封装（OpenAI 兼容接口）
+    
+    所有请求共用 get_client() 的 HTTP 连接池，检索时每次 embed_query 都复用已建立的连接，
+    不再重复 TCP + TLS 握手。
+    """
+    def __init__(self, model=EMBED_MODEL):
+        self.model = model
+    
+    def embed_documents(self, texts):
+        """对文档列表进行嵌入（按接口上限分批）"""
+        client = get_client()
+        vectors = []
+        for i in range(0, len(texts), EMBED_API_BATCH):
+            res = client.embeddings.create(model=self.model, input=texts[i:i+EMBED_API_BATCH])
+            vectors.extend(item.embedding for item in res.data)
+        return vectors
+    
+    def embed_query(self, text):
+        """对单个查询进行嵌入"""
+        res = get_client().embeddings.create(model=self.model, input=[text])
+        return res.data[0].embedding
+
+def _chunk_key(text):
+    """片段内容哈希（包含模型名，换模型后缓存自动失效）"""
+    return hashlib.blake2b(f"{EMBED_MODEL}\0{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+def load_embedding_cache(path):
+    """加载片段向量缓存，返回 {内容哈希: 向量}"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        data = np.load(path)
+        return dict(zip(data["keys"].tolist(), data["vecs"]))
+    except Exception as e:
+        print(f"⚠️  警告：向量缓存读取失败 - {e}，将重新向量化")
+        return {}
+
+def save_embedding_cache(path, cache):
+    """把片段向量缓存保存为单个 .npz 文件"""
+    if not cache:
+        return
+    keys = list(cache)
+    np.savez(path, keys=np.array(keys), vecs=np.array([cache[k] for k in keys], dtype=np.float32))
+
+def embed_with_cache(embedding_model, texts, cache):
+    """向量化文本列表，命中缓存的片段直接复用，只对未命中的片段调用 Embedding 接口"""
+    keys = [_chunk_key(t) for t in texts]
+    missing = [i for i, k in enumerate(keys) if k not in cache]
+    if missing:
+        vectors = embedding_model.embed_documents([texts[i] for i in missing])
+        for i, vec in zip(missing, vectors):
+            cache[keys[i]] = np.asarray(vec, dtype=np.float32)
+    return [cache[k].tolist() for k in keys]
+
+def embed_and_insert(collection, embedding_model, ids, chunks, metadatas, cache):
+    """
+    流水线式向量化并写入向量库
+    
+    多个线程并发调用 Embedding 接口（生产者），主线程从队列中取出结果写入 Chroma（消费者），
+    网络等待与本地写入互相重叠，总耗时约为两者中较慢的一方。
+    任意一方出错时设置 stop，尚未开始的批次不再调用 Embedding 接口。
+    """
+    batches = [slice(i, i + INSERT_BATCH_SIZE) for i in range(0, len(chunks), INSERT_BATCH_SIZE)]
+    q = queue.Queue(maxsize=EMBED_QUEUE_SIZE)
+    stop = threading.Event()
+    
+    def embed_batch(sl):
+        if stop.is_set():
+            return
+        try:
+            vectors = embed_with_cache(embedding_model, chunks[sl], cache)
+        except Exception:
+            stop.set()
+            raise
+        if not stop.is_set():
+            q.put((ids[sl], vectors, chunks[sl], metadatas[sl]))
+    
+    def produce():
+        try:
+            with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as ex:
+                list(ex.map(embed_batch, batches))
+        except Exception as e:
+            q.put(e)
+        finally:
+            q.put(None)  # 结束标记
+    
+    threading.Thread(target=produce, daemon=True).start()
+    
+    finished = False
+    try:
+        while True:
+            item = q.get()
+            if item is None:
+                finished = True
+                break
+            if isinstance(item, Exception):
+                raise item
+            batch_ids, batch_vectors, batch_docs, batch_metas = item
+            collection.add(
+                ids=batch_ids,
+                embeddings=batch_vectors,
+                documents=batch_docs,
+                metadatas=batch_metas
+            )
+    finally:
+        if not finished:
+            # 出错退出时通知生产者停止，并继续取空队列直到结束标记，
+            # 否则阻塞在 q.put 上的线程永远不会结束，解释器退出时会一直等待
+            stop.set()
+            while q.get() is not None:
+                pass
+
 def build_or_load_vectorstore(chunks, metadatas, persist_dir, embedding_model):
     """
     构建或加载向量数据库
@@ -135,12 +309,27 @@ def build_or_load_vectorstore(chunks, metadatas, persist_dir, embedding_model):
     print(f"   - 切片大小: {CHUNK_SIZE} 字符")
     print(f"   - 重叠大小: {CHUNK_OVERLAP} 字符")
     
-    vect = Chroma.from_texts(
-        texts=chunks, 
-        embedding=embedding_model, 
-        metadatas=metadatas, 
-        persist_directory=persist_dir
+    # 在 Chroma 外部计算向量并按批写入，向量化与写入流水线并行
+    ids = [f"{m['source']}-{m['chunk_index']}" for m in metadatas]
+    
+    vect = Chroma(
+        persist_directory=persist_dir,
+        embedding_function=embedding_model,
+        collection_metadata=HNSW_METADATA
     )
+    cache = load_embedding_cache(EMB_CACHE_FILE)
+    # 先在主线程创建共享客户端：lru_cache 不防并发，多个线程同时首次调用会各建一个连接池
+    get_client()
+    try:
+        embed_and_insert(vect._collection, embedding_model, ids, chunks, metadatas, cache)
+    except Exception:
+        # 每批向量算完即写入，中途出错时库里只有部分片段；删除半成品，
+        # 否则下次运行会把它当作完整的数据库加载
+        shutil.rmtree(persist_dir, ignore_errors=True)
+        raise
+    finally:
+        # 已经算好的向量（包括出错前完成的批次）都保存下来，重试时不必重新请求接口
+        save_embedding_cache(EMB_CACHE_FILE, cache)
     
     # 持久化向量数据库
     try:
@@ -151,14 +340,77 @@ def build_or_load_vectorstore(chunks, metadatas, persist_dir, embedding_model):
     
     return vect
 
+def build_or_load_faiss(chunks, metadatas, persist_dir, embedding_model):
+    """
+    构建或加载 FAISS 向量数据库（适合 10 万级以上的片段）
+    
+    加载时跳过 FAISS.load_local（它会先把整个索引读入内存），只从 index.pkl 读取文档库，
+    再以 IO_FLAG_MMAP_IFC 内存映射方式读取扁平索引的向量数据，向量按需从磁盘换入。
+    说明：片段原文（docstore）仍全部在内存中；faiss 版本过旧、不支持该标志时退回完整读入。
+    需要额外安装：uv add faiss-cpu
+    """
+    import pickle
+    import faiss
+    from langchain_community.vectorstores import FAISS
+    
+    # 检查环境变量
+    if not os.environ.get("QWEN_API_KEY"):
+        raise ValueError("请设置环境变量 QWEN_API_KEY")
+    
+    index_file = os.path.join(persist_dir, "index.faiss")
+    if os.path.exists(index_file):
+        try:
+            print(f"📂 检测到已有 FAISS 索引，正在加载...")
+            # index.pkl 由本脚本（save_local）生成，可信
+            with open(os.path.join(persist_dir, "index.pkl"), "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            # IO_FLAG_MMAP 只映射 IVF 倒排表；IndexFlat 的向量需要较新版本 faiss 提供的 IO_FLAG_MMAP_IFC
+            mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+            if mmap_flag is None:
+                print(f"⚠️  当前 faiss 版本不支持内存映射扁平索引，将完整读入内存")
+                index = faiss.read_index(index_file)
+            else:
+                index = faiss.read_index(index_file, mmap_flag)
+            vect = FAISS(
+                embedding_function=embedding_model,
+                index=index,
+                docstore=docstore,
+                index_to_docstore_id=index_to_docstore_id,
+            )
+            print(f"✅ 成功加载已有 FAISS 索引（包含 {vect.index.ntotal} 条记录）")
+            return vect
+        except Exception as e:
+            print(f"⚠️  加载 FAISS 索引失败: {e}，将重新构建...")
+    
+    # 构建新索引
+    print(f"🔨 正在构建 FAISS 索引...")
+    print(f"   - 文档数量: {len(chunks)}")
+    
+    cache = load_embedding_cache(EMB_CACHE_FILE)
+    vectors = embed_with_cache(embedding_model, chunks, cache)
+    save_embedding_cache(EMB_CACHE_FILE, cache)
+    vect = FAISS.from_embeddings(
+        text_embeddings=list(zip(chunks, vectors)),
+        embedding=embedding_model,
+        metadatas=metadatas
+    )
+    vect.save_local(persist_dir)
+    print(f"✅ FAISS 索引构建完成并已保存到 {persist_dir}")
+    
+    return vect
+
 try:
     # 初始化 Embedding 模型
-    emb = DashScopeEmbeddings(model="text-embedding-v4")
+    emb = QwenEmbeddings(model=EMBED_MODEL)
     print("✅ Embedding 模型初始化成功")
     
     # 构建或加载向量数据库
     # 注意：如果数据库已存在且完整，会直接加载；否则会重新构建
-    vect = build_or_load_vectorstore(chunks, metadatas, PERSIST_DIR, emb)
+    # 设置环境变量 VECTOR_BACKEND=faiss 可切换为 FAISS 后端
+    if VECTOR_BACKEND == "faiss":
+        vect = build_or_load_faiss(chunks, metadatas, FAISS_PERSIST_DIR, emb)
+    else:
+        vect = build_or_load_vectorstore(chunks, metadatas, PERSIST_DIR, emb)
 
 except ValueError as e:
     print(f"❌ 配置错误：{e}")
@@ -182,15 +434,30 @@ except Exception as e:
     print(f"❌ 错误：检索器初始化失败 - {e}")
     sys.exit(1)
 
+@lru_cache(maxsize=1024)
+def get_cached_embedding(query):
+    """
+    获取查询向量（带 LRU 缓存）
+
+    相同问题重复提问时直接命中缓存，省去一次 Embedding 网络往返。
+    返回 tuple 以保证缓存内容不会被调用方修改。
+    """
+    return tuple(emb.embed_query(query))
+
+def retrieve(query, source_filter=None):
+    """
+    使用缓存的查询向量在向量库中检索 top-k 文档
+    
+    指定 source_filter 时先按来源文件过滤，只在该文件的片段中做 ANN 检索。
+    """
+    vec = get_cached_embedding(query)
+    search_filter = {"source": source_filter} if source_filter else None
+    return vect.similarity_search_by_vector(list(vec), k=TOP_K, filter=search_filter)
+
 # -----------------------
 # 5) LLM调用
 # -----------------------
-# 此处复用 only_llm.py 的实现
-try:
-    from only_llm import chat_qwen
-except ImportError:
-    print("❌ 错误：无法导入 only_llm 模块，请确保 only_llm.py 文件存在")
-    sys.exit(1)
+# 此处复用 only_llm.py 的实现（chat_qwen 已在第 3 步导入）
 
 # -----------------------
 # 6) 把检索到的片段拼成 prompt
@@ -209,12 +476,14 @@ def build_prompt(query, docs):
     if not docs:
         return f"用户问题：{query}\n\n注意：未检索到相关文档，请回答\"我不知道\"。"
     
-    parts = []
-    for i, d in enumerate(docs, start=1):
-        # 兼容不同返回结构（Document对象或字典）
-        text = getattr(d, "page_content", str(d))
-        src = d.metadata.get("source", "unknown") if hasattr(d, "metadata") else "unknown"
-        parts.append(f"[片段 {i} | 来源: {src}]\n{text}\n")
+    # 兼容不同返回结构（Document对象或其他）：类型只判断一次，循环内不再做反射调用
+    if hasattr(docs[0], "page_content"):
+        parts = [
+            f"[片段 {i} | 来源: {d.metadata.get('source', 'unknown')}]\n{d.page_content}\n"
+            for i, d in enumerate(docs, start=1)
+        ]
+    else:
+        parts = [f"[片段 {i} | 来源: unknown]\n{d}\n" for i, d in enumerate(docs, start=1)]
     
     context = "\n".join(parts)
     prompt = (
@@ -229,24 +498,47 @@ def build_prompt(query, docs):
 # -----------------------
 # 7) RAG查询函数（供外部调用）
 # -----------------------
-def rag_query(query, retriever_instance=None, model=QWEN_MODEL):
+async def arag_query(query, retrievers=None, model=QWEN_MODEL, stream=False, source_filter=None):
     """
-    RAG查询函数
+    异步 RAG 查询函数
+    
+    多个检索器（例如 BM25 + 向量检索）并发执行，总检索耗时只取决于最慢的一路。
     
     Args:
         query: 用户问题
-        retriever_instance: 检索器实例（如果为None，使用全局retriever）
+        retrievers: 检索器列表（如果为None，使用带缓存的全局向量库检索）
         model: LLM模型名称
+        stream: 是否流式返回回答（为True时answer是逐段产出文本的生成器）
+        source_filter: 只在指定来源文件（如 "faq.md"）中检索，仅对全局向量库检索生效
     
     Returns:
         dict: 包含answer和sources的字典
     """
-    if retriever_instance is None:
-        retriever_instance = retriever
-    
     try:
-        # 检索相关文档
-        docs = retriever_instance.invoke(query)
+        # 并发检索相关文档（阻塞调用放到线程池中执行）
+        if retrievers:
+            tasks = [asyncio.to_thread(r.invoke, query) for r in retrievers]
+        else:
+            tasks = [asyncio.to_thread(retrieve, query, source_filter)]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        # 合并各路结果：跳过失败的检索器，按内容去重并保持原有顺序
+        docs = []
+        seen = set()
+        errors = []
+        for res in results:
+            if isinstance(res, Exception):
+                errors.append(res)
+                continue
+            for d in res:
+                key = getattr(d, "page_content", str(d))
+                if key not in seen:
+                    seen.add(key)
+                    docs.append(d)
+        if errors and len(errors) == len(results):
+            raise errors[0]
+        for e in errors:
+            print(f"⚠️  警告：部分检索器失败 - {e}")
         
         if not docs:
             return {
@@ -258,7 +550,7 @@ def rag_query(query, retriever_instance=None, model=QWEN_MODEL):
         prompt = build_prompt(query, docs)
         
         # 调用 LLM 生成回答
-        answer = chat_qwen(prompt, model=model, stream=False)
+        answer = await asyncio.to_thread(chat_qwen, prompt, model=model, stream=stream)
         
         # 提取来源
         sources = []
@@ -276,6 +568,25 @@ def rag_query(query, retriever_instance=None, model=QWEN_MODEL):
             "sources": []
         }
 
+def rag_query(query, retriever_instance=None, model=QWEN_MODEL, stream=False, source_filter=None):
+    """
+    RAG查询函数（arag_query 的同步封装）
+    
+    Args:
+        query: 用户问题
+        retriever_instance: 检索器实例（如果为None，使用带缓存的全局向量库检索）
+        model: LLM模型名称
+        stream: 是否流式返回回答（为True时answer是逐段产出文本的生成器）
+        source_filter: 只在指定来源文件（如 "faq.md"）中检索，仅对全局向量库检索生效
+    
+    Returns:
+        dict: 包含answer和sources的字典
+    """
+    retrievers = [retriever_instance] if retriever_instance is not None else None
+    return asyncio.run(arag_query(
+        query, retrievers=retrievers, model=model, stream=stream, source_filter=source_filter
+    ))
+
 # -----------------------
 # 8) 运行示例查询
 # -----------------------
@@ -0,0 +1,116 @@
+"""
+查询缓存：把 Embedding 结果和 LLM 回答缓存到磁盘，重复提问时直接返回，省去 API 调用。
+
+包含两层缓存：
+  - 精确缓存：按 (模型, 规范化文本) 的哈希命中，用于 embed_query 和 qwen_chat
+  - 语义缓存：新问题的向量与历史问题的余弦相似度超过阈值时，直接复用历史回答；
+    按 scope（向量库路径、top-k、检索方式等）分开保存，不同知识库之间互不命中
+说明：
+  - 缓存保存在 cache/ 目录下，默认有效期 1 天
+  - 知识库更新后调用 invalidate() 清空回答缓存，避免返回旧的回答；
+    查询向量与知识库内容无关，Embedding 缓存保留
+"""
+
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from diskcache import Cache
+
+# 常量定义
+CACHE_DIR = "cache"
+CACHE_TTL = 86400               # 缓存有效期（秒）
+SEMANTIC_THRESHOLD = 0.97       # 语义缓存命中的余弦相似度阈值
+
+@lru_cache(maxsize=None)
+def get_cache(name):
+    """按名称获取磁盘缓存（首次使用时创建目录）"""
+    return Cache(f"{CACHE_DIR}/{name}")
+
+def make_key(model, text):
+    """缓存键：模型名 + 去除多余空白后的文本，取 BLAKE2b 哈希"""
+    normalized = " ".join(text.split())
+    return hashlib.blake2b(f"{model}\0{normalized}".encode("utf-8")).hexdigest()
+
+def cached_call(name, model, text, fn):
+    """精确缓存：命中时直接返回缓存值，否则调用 fn() 并写入缓存"""
+    cache = get_cache(name)
+    key = make_key(model, text)
+    value = cache.get(key)
+    if value is None:
+        value = fn()
+        cache.set(key, value, expire=CACHE_TTL)
+    return value
+
+class SemanticCache:
+    """语义缓存：在内存中保存历史问题向量矩阵，按余弦相似度查找相近问题的回答"""
+    def __init__(self, name="semantic", threshold=SEMANTIC_THRESHOLD):
+        self.cache = get_cache(name)
+        self.threshold = threshold
+        self._keys = None
+        self._vectors = None
+
+    @staticmethod
+    def _normalize(vec):
+        v = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm > 0 else v
+
+    def _load(self):
+        """从磁盘加载历史问题向量（只在首次查询时执行）"""
+        keys, vectors = [], []
+        for key in self.cache.iterkeys():
+            item = self.cache.get(key)
+            if item is not None:
+                keys.append(key)
+                vectors.append(self._normalize(item[0]))
+        self._keys = keys
+        self._vectors = np.array(vectors, dtype=np.float32) if vectors else None
+
+    def lookup(self, vec):
+        """查找与 vec 足够相似的历史问题，命中时返回其回答，否则返回 None"""
+        if self._keys is None:
+            self._load()
+        if self._vectors is None:
+            return None
+        sims = self._vectors @ self._normalize(vec)
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+        item = self.cache.get(self._keys[best])  # 已过期时返回 None
+        return item[1] if item is not None else None
+
+    def add(self, key, vec, answer):
+        """记录问题向量及其回答"""
+        self.cache.set(key, (list(vec), answer), expire=CACHE_TTL)
+        if self._keys is None:
+            self._load()
+            return
+        v = self._normalize(vec)[None, :]
+        self._keys.append(key)
+        self._vectors = v if self._vectors is None else np.vstack([self._vectors, v])
+
+    def clear(self):
+        self.cache.clear()
+        self._keys = None
+        self._vectors = None
+
+@lru_cache(maxsize=None)
+def _semantic_cache(name):
+    return SemanticCache(name)
+
+def get_semantic_cache(scope=""):
+    """按 scope 获取语义缓存：每个 scope 对应 cache/ 下一个独立目录"""
+    if not scope:
+        return _semantic_cache("semantic")
+    digest = hashlib.blake2b(scope.encode("utf-8"), digest_size=8).hexdigest()
+    return _semantic_cache(f"semantic_{digest}")
+
+def invalidate():
+    """清空回答缓存（知识库更新后调用），Embedding 缓存不受影响"""
+    get_cache("answers").clear()
+    # 各 scope 的语义缓存都要清空，包括本进程尚未打开过的
+    for path in Path(CACHE_DIR).glob("semantic*"):
+        if path.is_dir():
+            _semantic_cache(path.name).clear()
@@ -1,40 +1,106 @@
-import os
 import json
-from openai import OpenAI
+import asyncio
+import orjson
+import numpy as np
+from qwen_client import get_client
 from langchain_community.embeddings import OllamaEmbeddings
 from pathlib import Path
 
 # 常量定义
 EMBED_MODEL = "text-embedding-v4"
 DEFAULT_TOP_RERANK = 10
+MAX_CONCURRENCY = 8             # 并发请求上限
 
-def embed_text(texts: any, model: str = EMBED_MODEL):
+async def aembed_text(texts: any, model: str = EMBED_MODEL):
     """
-    将单个字符串或字符串列表转为向量。
+    embed_text 的异步版本：所有批次并发请求，总耗时约等于最慢的一批。
     返回：如果输入是字符串，返回 list(float)；如果输入是 list[str]，返回 list[list[float]]
-    使用 Aliyun-compatible OpenAI SDK (OpenAI class) to call embeddings.create.
     """
-    client = OpenAI(api_key=os.environ.get("QWEN_API_KEY"),
-                    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1")
+    client = get_client()
     single_input = False
     if isinstance(texts, str):
         texts = [texts]
         single_input = True
 
-    # 检查批量大小，如果超过10个则分批处理
-    if len(texts) > DEFAULT_TOP_RERANK:
-        embeddings = []
-        for i in range(0, len(texts), DEFAULT_TOP_RERANK):
-            batch = texts[i:i+DEFAULT_TOP_RERANK]
-            res = client.embeddings.create(model=model, input=batch)
-            embeddings.extend([item.embedding for item in res.data])
-    else:
-        # 调用 embeddings API
-        res = client.embeddings.create(model=model, input=texts)
-        embeddings = [item.embedding for item in res.data]
+    # 接口单次最多10条，按批切分后并发调用；信号量限制同时在途的请求数，避免触发限流
+    batches = [texts[i:i+DEFAULT_TOP_RERANK] for i in range(0, len(texts), DEFAULT_TOP_RERANK)]
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def _one(batch):
+        async with semaphore:
+            return await asyncio.to_thread(client.embeddings.create, model=model, input=batch)
+
+    results = await asyncio.gather(*[_one(b) for b in batches])
+
+    # gather 按提交顺序返回结果，展开后与输入顺序一致
+    embeddings = [item.embedding for res in results for item in res.data]
 
     return embeddings[0] if single_input else embeddings
 
+def embed_text(texts: any, model: str = EMBED_MODEL):
+    """
+    将单个字符串或字符串列表转为向量。
+    返回：如果输入是字符串，返回 list(float)；如果输入是 list[str]，返回 list[list[float]]
+    使用 Aliyun-compatible OpenAI SDK (OpenAI class) to call embeddings.create.
+    """
+    return asyncio.run(aembed_text(texts, model=model))
+
+def quantize_int8(vectors, per_vector=False):
+    """
+    int8 量化：对称缩放，体积约为 float32 的 1/4。
+    per_vector=False 时每个维度一个缩放系数；per_vector=True 时每条向量一个缩放系数（可以逐条追加写入）。
+    返回：(q, scale)，q 为 int8 矩阵，scale 为缩放系数，还原时 q * scale
+    """
+    vecs = np.asarray(vectors, dtype=np.float32)
+    scale = np.abs(vecs).max(axis=1 if per_vector else 0, keepdims=per_vector) / 127
+    scale[scale == 0] = 1.0  # 避免全零维度除零
+    q = np.round(vecs / scale).astype(np.int8)
+    return q, scale
+
+def dequantize_int8(q, scale):
+    """把 int8 量化结果还原为近似的 float32 向量"""
+    return q.astype(np.float32) * scale
+
+def quantize_binary(vectors):
+    """
+    二值量化：只保留每一维的符号位并按位打包，体积约为 float32 的 1/32。
+    返回：uint8 矩阵，形状为 (n, ceil(dim/8))
+    """
+    vecs = np.asarray(vectors, dtype=np.float32)
+    return np.packbits(vecs > 0, axis=1)
+
+def hamming_search(bits, query_bits, k=3):
+    """
+    在二值向量上按汉明距离检索 top-k。
+    返回：(indices, distances)，按距离从小到大排序
+    """
+    dist = np.unpackbits(np.bitwise_xor(bits, query_bits), axis=1).sum(axis=1)
+    k = min(k, len(dist))
+    idx = np.argpartition(dist, k - 1)[:k]
+    idx = idx[np.argsort(dist[idx])]
+    return idx, dist[idx]
+
+def int8_search(q, scale, query_vec, k=3, candidates=None):
+    """
+    在 int8 向量上按内积检索 top-k（向量已归一化时即余弦相似度）。
+    candidates 为候选下标（例如 hamming_search 的粗排结果），为 None 时全量计算。
+    返回：(indices, scores)，按得分从大到小排序
+    """
+    if candidates is None:
+        candidates = np.arange(len(q))
+    query = np.asarray(query_vec, dtype=np.float32)
+    # 转为 float32 后矩阵乘法走 BLAS
+    vecs = q[candidates].astype(np.float32)
+    if scale.ndim == 2:
+        # 每条向量一个 scale：先算内积再缩放，少一次整矩阵乘法
+        scores = (vecs @ query) * scale[candidates, 0]
+    else:
+        scores = vecs @ (query * scale)
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return candidates[top], scores[top]
+
 def main():
     import os
     from pathlib import Path
@@ -67,8 +133,8 @@ def main():
     print(f"\n📖 正在加载切片文件...")
     print(f"   文件路径: {chunks_file}")
     
-    with open(chunks_file, "r", encoding="utf-8") as f:
-        chunks = json.load(f)
+    # orjson 在 C 层解析，比标准库 json 快数倍
+    chunks = orjson.loads(chunks_file.read_bytes())
     
     texts = [c["text"] for c in chunks]
     ids = [c["id"] for c in chunks]
@@ -87,6 +153,7 @@ def main():
     print(f"   - 模型: {EMBED_MODEL}")
     print(f"   - 批次大小: {batch_size}")
     print(f"   - 预计批次: {(len(texts) + batch_size - 1) // batch_size} 批")
+    print(f"   - 并发上限: {MAX_CONCURRENCY}")
     
     start_time = datetime.now()
     vectors = embed_text(texts, model=EMBED_MODEL)
@@ -116,6 +183,21 @@ def main():
     
     print(f"   - 输出文件: {output_file}")
     
+    # ========== 向量量化 ==========
+    print(f"\n📦 向量量化（减少内存与带宽占用）...")
+    q, scale = quantize_int8(vectors)
+    bits = quantize_binary(vectors)
+    fp32_size = len(vectors) * len(vectors[0]) * 4
+    
+    output_file_int8 = output_dir / "embeddings_int8.npz"
+    np.savez(output_file_int8, ids=np.array(ids), q=q, scale=scale)
+    output_file_binary = output_dir / "embeddings_binary.npz"
+    np.savez(output_file_binary, ids=np.array(ids), bits=bits)
+    
+    print(f"   - float32: {fp32_size / 1024:.1f} KB")
+    print(f"   - int8   : {q.nbytes / 1024:.1f} KB（{fp32_size / q.nbytes:.0f}x 压缩） -> {output_file_int8}")
+    print(f"   - binary : {bits.nbytes / 1024:.1f} KB（{fp32_size / bits.nbytes:.0f}x 压缩） -> {output_file_binary}")
+    
     # ========== 使用Ollama模型（可选）==========
     print(f"\n{'='*70}")
     print("方法2：使用本地 Ollama 模型（可选对比）")
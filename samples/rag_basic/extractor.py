@@ -12,16 +12,57 @@
 """
 
 import os
+import logging
 import pdfplumber
 import pandas as pd
 import re
 import chardet
+from concurrent.futures import ProcessPoolExecutor
 from docx import Document   #! 此处安装特别注意：uv add python-docx
+from openpyxl import load_workbook
+
+# 错误详情（traceback）只在 DEBUG 日志级别输出，批量提取时不会刷屏
+logger = logging.getLogger(__name__)
 
 # API说明：
 
 # 用户唯一需要调用的API是 extract_file，该函数自动根据后缀调用不同的函数，实现文件的提取
 
+# PDF 页数达到该值时使用多进程并行提取（页数少时进程启动开销大于收益）
+PDF_PARALLEL_MIN_PAGES = 50
+
+# CSV 编码检测只读取文件开头的字节数
+CSV_ENCODING_PROBE_BYTES = 64 * 1024
+
+# Markdown 清理规则：(正则, 替换, flags)，按顺序依次执行。
+# 每条规则单独一遍扫描，后面的规则会处理前面规则的输出，
+# 因此 "## 1. 标题"、"> - 列表"、"***强调***" 这类嵌套标记能被逐层去掉。
+_MD_RULES = (
+    # 图片标记 ![alt](url)
+    (r'!\[.*?\]\(.*?\)', '', 0),
+    # 外链标记 [text](url)
+    (r'\[([^\]]+)\]\([^\)]+\)', r'\1', 0),
+    # 代码块 ```language ... ```（先于行内代码处理，避免代码块中的 ` 被当作行内代码）
+    (r'```.*?```', '', re.DOTALL),
+    # 行内代码 `
+    (r'`([^`]+)`', r'\1', 0),
+    # 加粗 **（先于斜体）
+    (r'\*\*(.*?)\*\*', r'\1', 0),
+    # 斜体 *
+    (r'\*([^*]+)\*', r'\1', 0),
+    # 标题 #
+    (r'^#+\s*', '', re.MULTILINE),
+    # 分隔线 ---
+    (r'^---$', '', re.MULTILINE),
+    # 引用 >
+    (r'^>\s*', '', re.MULTILINE),
+    # 列表 - * 与 1.
+    (r'^[\-*]\s+', '', re.MULTILINE),
+    (r'^\d+\.\s+', '', re.MULTILINE),
+)
+# 在模块加载时预编译一次，所有调用共享
+_MD_PATTERNS = [(re.compile(p, f), r) for p, r, f in _MD_RULES]
+
 
 def extract_file(file_path: str) -> str:
     """
@@ -43,11 +84,18 @@ def extract_file(file_path: str) -> str:
         raise ValueError(f"不支持的文件类型: {ext}")
     
 
+def _extract_pdf_pages(pdf_path: str, page_numbers: list) -> list:
+    """在子进程中只打开并提取指定页（页码从 1 开始）的文本"""
+    with pdfplumber.open(pdf_path, pages=page_numbers) as pdf:
+        return [page.extract_text() for page in pdf.pages]
+
+
 def extract_pdf(pdf_path: str) -> str:
     """
     从 PDF 文件中提取文本内容。
     
     使用 pdfplumber 库提取 PDF 文件中的文本内容。
+    页数较多时按连续页段分配给多个进程并行解析，每个进程只加载自己负责的页。
 
     Args:
         pdf_path (str): PDF 文件的路径
@@ -63,10 +111,20 @@ def extract_pdf(pdf_path: str) -> str:
 
         print(f"[INFO] 正在尝试从 '{pdf_path}' 提取文本...")
         with pdfplumber.open(pdf_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                page_text = page.extract_text()
-                if page_text:
-                    text_content += page_text + "\n"
+            page_count = len(pdf.pages)
+            if page_count < PDF_PARALLEL_MIN_PAGES:
+                page_texts = [page.extract_text() for page in pdf.pages]
+        
+        if page_count >= PDF_PARALLEL_MIN_PAGES:
+            workers = min(os.cpu_count() or 1, page_count)
+            size = (page_count + workers - 1) // workers
+            groups = [list(range(i + 1, min(i + size, page_count) + 1)) for i in range(0, page_count, size)]
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                results = ex.map(_extract_pdf_pages, [pdf_path] * len(groups), groups)
+                page_texts = [t for group in results for t in group]
+        
+        # 收集到列表后一次性拼接，避免逐页字符串累加
+        text_content = "\n".join(t for t in page_texts if t)
         print(f"[INFO] 成功从 PDF 提取文本。")
     except FileNotFoundError as fnf_err:
         error_msg = f"[ERROR] 文件未找到: {fnf_err}"
@@ -75,8 +133,7 @@ def extract_pdf(pdf_path: str) -> str:
     except Exception as e:
         error_msg = f"[ERROR] 从 PDF '{pdf_path}' 提取文本时出错: {e}"
         print(error_msg)
-        import traceback
-        traceback.print_exc()
+        logger.debug("PDF 提取失败", exc_info=True)
         text_content = error_msg
     return text_content.strip()
 
@@ -85,7 +142,8 @@ def extract_excel(excel_path: str) -> str:
     """
     从 Excel 文件中提取文本内容。
     
-    使用 pandas 库提取 Excel 文件中的文本内容。
+    .xlsx 使用 openpyxl 只读模式逐行流式读取，内存占用与行数无关；
+    旧版 .xls 格式 openpyxl 不支持，仍使用 pandas 读取。
 
     Args:
         excel_path (str): Excel 文件的路径
@@ -100,23 +158,43 @@ def extract_excel(excel_path: str) -> str:
             raise FileNotFoundError(f"Excel 文件不存在: {excel_path}")
             
         print(f"[INFO] 正在尝试从 '{excel_path}' 提取文本...")
-        # 读取Excel文件的所有工作表
-        excel_data = pd.read_excel(excel_path, sheet_name=None, header=None)
-        
+        parts = []
         sheet_count = 0
-        for sheet_name, df in excel_data.items():
-            # 检查工作表是否为空
-            if df.empty:
-                continue
-                
-            text_content += f"\n--- Sheet: {sheet_name} ---\n"
-            # 将DataFrame转换为字符串
-            text_content += df.to_string(index=False, header=False) + "\n"
-            sheet_count += 1
+        if excel_path.lower().endswith(".xls"):
+            # 读取Excel文件的所有工作表
+            excel_data = pd.read_excel(excel_path, sheet_name=None, header=None)
+            for sheet_name, df in excel_data.items():
+                # 检查工作表是否为空
+                if df.empty:
+                    continue
+                parts.append(f"\n--- Sheet: {sheet_name} ---")
+                # 将DataFrame转换为制表符分隔的文本（与 .xlsx 的输出格式一致）
+                parts.append(df.to_csv(sep='\t', index=False, header=False).rstrip('\n'))
+                sheet_count += 1
+        else:
+            # data_only=True 读取公式的计算结果而不是公式本身
+            wb = load_workbook(excel_path, read_only=True, data_only=True)
+            try:
+                for ws in wb.worksheets:
+                    rows = [
+                        "\t".join("" if v is None else str(v) for v in row)
+                        for row in ws.iter_rows(values_only=True)
+                        if any(v is not None for v in row)
+                    ]
+                    # 检查工作表是否为空
+                    if not rows:
+                        continue
+                    parts.append(f"\n--- Sheet: {ws.title} ---")
+                    parts.extend(rows)
+                    sheet_count += 1
+            finally:
+                # 只读模式会保持文件句柄打开，需要显式关闭
+                wb.close()
             
         if sheet_count == 0:
             text_content = "[INFO] Excel文件中没有数据内容"
         else:
+            text_content = "\n".join(parts)
             print(f"[INFO] 成功从 Excel 提取文本。")
     except FileNotFoundError as fnf_err:
         error_msg = f"[ERROR] 文件未找到: {fnf_err}"
@@ -125,8 +203,7 @@ def extract_excel(excel_path: str) -> str:
     except Exception as e:
         error_msg = f"[ERROR] 从 Excel '{excel_path}' 提取文本时出错: {e}"
         print(error_msg)
-        import traceback
-        traceback.print_exc()
+        logger.debug("Excel 提取失败", exc_info=True)
         text_content = error_msg
         
     return text_content.strip()
@@ -155,30 +232,9 @@ def extract_markdown(md_path: str) -> str:
         with open(md_path, 'r', encoding='utf-8') as file:
             text_content = file.read()
             
-        # 移除Markdown标记以获取纯文本
-        # 移除图片标记 [alt](url)
-        text_content = re.sub(r'!\[.*?\]\(.*?\)', '', text_content)
-        # 移除外链标记 [text](url)
-        text_content = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text_content)
-        # 移除行内代码 `
-        text_content = re.sub(r'`([^`]+)`', r'\1', text_content)
-        # 移除代码块标记 ```
-        text_content = re.sub(r'```.*?```', '', text_content, flags=re.DOTALL)
-        # 移除代码块标记 ```language
-        text_content = re.sub(r'```[a-z]*\n.*?```', '', text_content, flags=re.DOTALL)
-        # 移除加粗标记 **
-        text_content = re.sub(r'\*\*(.*?)\*\*', r'\1', text_content)
-        # 移除斜体标记 *
-        text_content = re.sub(r'\*([^*]+)\*', r'\1', text_content)
-        # 移除标题标记 #
-        text_content = re.sub(r'^#+\s*', '', text_content, flags=re.MULTILINE)
-        # 移除分隔线 ---
-        text_content = re.sub(r'^---$', '', text_content, flags=re.MULTILINE)
-        # 移除引用标记 >
-        text_content = re.sub(r'^>\s*', '', text_content, flags=re.MULTILINE)
-        # 移除列表标记
-        text_content = re.sub(r'^[\-*]\s+', '', text_content, flags=re.MULTILINE)
-        text_content = re.sub(r'^\d+\.\s+', '', text_content, flags=re.MULTILINE)
+        # 移除Markdown标记以获取纯文本（使用预编译正则）
+        for pattern, repl in _MD_PATTERNS:
+            text_content = pattern.sub(repl, text_content)
         
         print(f"[INFO] 成功从 Markdown 提取文本。")
     except FileNotFoundError as fnf_err:
@@ -188,8 +244,7 @@ def extract_markdown(md_path: str) -> str:
     except Exception as e:
         error_msg = f"[ERROR] 从 Markdown '{md_path}' 提取文本时出错: {e}"
         print(error_msg)
-        import traceback
-        traceback.print_exc()
+        logger.debug("Markdown 提取失败", exc_info=True)
         text_content = error_msg
         
     return text_content.strip()
@@ -218,21 +273,18 @@ def extract_word(word_path: str) -> str:
         # 使用 python-docx 读取 .docx 文件
         doc = Document(word_path)
         
-        # 提取所有段落的文本
-        for paragraph in doc.paragraphs:
-            # 只添加非空段落
-            if paragraph.text.strip():
-                text_content += paragraph.text + "\n"
+        # 提取所有段落的文本（只保留非空段落）
+        parts = [p.text for p in doc.paragraphs if p.text.strip()]
             
-        # 提取表格中的文本
+        # 提取表格中的文本，每行单元格用制表符连接
         for table in doc.tables:
-            text_content += "\n[表格内容开始]\n"
+            parts.append("\n[表格内容开始]")
             for row in table.rows:
-                row_content = ""
-                for cell in row.cells:
-                    row_content += cell.text.strip() + "\t"
-                text_content += row_content.rstrip("\t") + "\n"
-            text_content += "[表格内容结束]\n"
+                parts.append("\t".join(cell.text.strip() for cell in row.cells))
+            parts.append("[表格内容结束]")
+        
+        # 收集到列表后一次性拼接，避免逐段字符串累加
+        text_content = "\n".join(parts)
                 
         print(f"[INFO] 成功从 Word 提取文本。")
     except FileNotFoundError as fnf_err:
@@ -242,13 +294,47 @@ def extract_word(word_path: str) -> str:
     except Exception as e:
         error_msg = f"[ERROR] 从 Word '{word_path}' 提取文本时出错: {e}"
         print(error_msg)
-        import traceback
-        traceback.print_exc()
+        logger.debug("Word 提取失败", exc_info=True)
         text_content = error_msg
         
     return text_content.strip()
 
 
+def _csv_encoding_candidates(csv_path: str) -> list:
+    """
+    根据文件开头的字节检测 CSV 编码，返回按优先级排列的候选编码。
+    
+    检测只看开头的字节，可能不准，因此再补上 utf-8 和 gb18030 作为后备。
+    单字节编码（latin-1、cp1252 等）解码任何字节都不会报错，检测成这类编码时放到最后，
+    避免短小的 GBK 文件被误判后静默解码成乱码。
+    """
+    with open(csv_path, 'rb') as file:
+        head = file.read(CSV_ENCODING_PROBE_BYTES)
+    encoding = (chardet.detect(head)['encoding'] or 'utf-8').lower()
+    # 开头全是 ASCII 不代表后面没有中文；GB2312 的超集 GB18030 能覆盖生僻字
+    if encoding == 'ascii':
+        encoding = 'utf-8'
+    elif encoding in ('gb2312', 'gbk'):
+        encoding = 'gb18030'
+    single_byte = encoding in ('latin-1', 'iso-8859-1') or encoding.startswith(('windows-125', 'cp125', 'iso-8859'))
+    candidates = ['utf-8', 'gb18030']
+    if encoding in candidates:
+        candidates.remove(encoding)
+    return candidates + [encoding] if single_byte else [encoding] + candidates
+
+
+def _read_csv(csv_path: str, encoding: str):
+    """按指定编码读取 CSV；编码不对时抛出 UnicodeDecodeError"""
+    try:
+        # pyarrow 引擎多线程解析，比默认引擎快数倍
+        return pd.read_csv(csv_path, encoding=encoding, on_bad_lines='skip', engine='pyarrow')
+    except UnicodeDecodeError:
+        raise
+    except Exception:
+        # 未安装 pyarrow、文件格式不被支持或 pyarrow 包装了解码错误时，退回默认引擎
+        return pd.read_csv(csv_path, encoding=encoding, on_bad_lines='skip')
+
+
 def extract_csv(csv_path: str) -> str:
     """
     从 CSV 文件中提取文本内容。
@@ -269,30 +355,18 @@ def extract_csv(csv_path: str) -> str:
             
         print(f"[INFO] 正在尝试从 '{csv_path}' 提取文本...")
         
-        # 尝试不同的编码方式读取 CSV 文件
-        encodings = ['utf-8', 'gbk', 'gb2312', 'latin-1']
-        df = None
-        
-        for encoding in encodings:
+        # 先用文件开头的字节检测编码，通常只需完整解析一次文件；解码失败时依次尝试后备编码
+        candidates = _csv_encoding_candidates(csv_path)
+        for i, encoding in enumerate(candidates):
             try:
-                # 添加错误处理参数以应对格式问题
-                df = pd.read_csv(csv_path, encoding=encoding, on_bad_lines='skip')
+                df = _read_csv(csv_path, encoding)
                 break
             except UnicodeDecodeError:
-                continue
-            except pd.errors.ParserError:
-                continue
-        
-        if df is None:
-            # 如果常规方法失败，则使用二进制模式读取文件并检测编码
-            with open(csv_path, 'rb') as file:
-                raw_data = file.read()
-                encoding = chardet.detect(raw_data)['encoding']
-                # 再次尝试读取，使用检测到的编码
-                df = pd.read_csv(csv_path, encoding=encoding, on_bad_lines='skip')
+                if i == len(candidates) - 1:
+                    raise
         
-        # 将DataFrame转换为字符串
-        text_content = df.to_string(index=False)
+        # 将DataFrame转换为制表符分隔的文本（to_string 需要先对齐所有列，大表很慢）
+        text_content = df.to_csv(sep='\t', index=False)
                 
         print(f"[INFO] 成功从 CSV 提取文本。")
     except FileNotFoundError as fnf_err:
@@ -302,8 +376,7 @@ def extract_csv(csv_path: str) -> str:
     except Exception as e:
         error_msg = f"[ERROR] 从 CSV '{csv_path}' 提取文本时出错: {e}"
         print(error_msg)
-        import traceback
-        traceback.print_exc()
+        logger.debug("CSV 提取失败", exc_info=True)
         text_content = error_msg
         
     return text_content.strip()
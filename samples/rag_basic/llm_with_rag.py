@@ -11,36 +11,139 @@
 """
 
 import os
+import asyncio
+import hashlib
+import contextlib
 import argparse
 import logging
-from openai import OpenAI   # 用你之前的 only_llm 风格接入 qwen (openai-compatible)
+from functools import lru_cache
+from typing import Iterator
+from openai import AsyncOpenAI   # 用你之前的 only_llm 风格接入 qwen (openai-compatible)
 from langchain_community.vectorstores import Chroma
 
 # 添加QwenEmbeddings导入
-from store_manager import QwenEmbeddings
+from langchain_core.documents import Document
+from store_manager import COLLECTION_NAME, QwenEmbeddings, load_quantized_index, quantized_search
+from qwen_client import QWEN_BASE_URL, get_client
+from cache_manager import CACHE_TTL, cached_call, get_cache, get_semantic_cache, make_key
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+SPECULATIVE_MARGIN = 0.1   # 第 2 名片段的距离比 top-1 大出该值时，认为仅凭 top-1 的草稿回答已足够
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """进程内共享的 Embedding 实例"""
+    return QwenEmbeddings()
+
+@lru_cache(maxsize=4)
+def get_vectorstore(persist_dir: str):
+    """按数据库路径缓存 Chroma 实例，避免重复打开 SQLite 连接和加载索引"""
+    vect = Chroma(persist_directory=persist_dir, collection_name=COLLECTION_NAME,
+                  embedding_function=get_embeddings())
+    # 旧版 store_manager.py 使用默认集合名建库，用新集合名打开时得到的是空集合，检索不到任何内容
+    if vect._collection.count() == 0:
+        print(f"⚠️  警告：向量数据库 {persist_dir} 中的集合 '{COLLECTION_NAME}' 为空"
+              f"（可能是旧版本构建的数据库）")
+        print(f"💡 提示：请重新运行 store_manager.py 构建知识库")
+    return vect
+
+@lru_cache(maxsize=4)
+def get_retriever(persist_dir: str, k: int):
+    """按 (数据库路径, top-k) 缓存检索器"""
+    return get_vectorstore(persist_dir).as_retriever(search_kwargs={"k": k})
+
+@lru_cache(maxsize=4)
+def get_quantized_index(persist_dir: str):
+    """按数据库路径缓存量化索引（store_manager.py --quantize 生成）"""
+    return load_quantized_index(persist_dir)
+
+def quantized_retrieve(query, persist_dir, k):
+    """在量化索引上检索 top-k，再按 id 从 Chroma 取回原文；没有量化索引时返回 None"""
+    index = get_quantized_index(persist_dir)
+    if index is None:
+        return None
+    ids = quantized_search(index, get_embeddings().embed_query(query), k=k)
+    res = get_vectorstore(persist_dir).get(ids=ids)
+    found = {i: Document(page_content=text, metadata=meta or {})
+             for i, text, meta in zip(res["ids"], res["documents"], res["metadatas"])}
+    return [found[i] for i in ids if i in found]
+
+def semantic_scope(persist_dir, k, quantized=False):
+    """语义缓存的 scope：不同向量库、top-k 或检索方式得到的回答互不复用"""
+    return f"{os.path.abspath(persist_dir)}|k={k}|quantized={quantized}"
+
+# prompt 的固定部分预先写成常量：说明在前、问题在后
+_PROMPT_HEADER = (
+    "下面是检索到的知识片段（仅供参考）。请**仅基于这些片段**回答用户问题，"
+    "如果片段中没有相关信息，请回答“我不知道”。\n\n"
+)
+_PROMPT_FOOTER_TMPL = "\n用户问题：{query}\n\n请给出简洁准确的回答，并在末尾列出引用来源。"
+
+def _doc_fields(d):
+    """返回 (正文, 来源)；检索结果通常是 LangChain Document，直接取属性，其他类型才走 getattr 兜底"""
+    if isinstance(d, Document):
+        return d.page_content, d.metadata.get("source", "unknown")
+    text = getattr(d, "page_content", getattr(d, "content", str(d)))
+    src = d.metadata.get("source", "unknown") if hasattr(d, "metadata") else "unknown"
+    return text, src
+
+def dedupe_docs(docs):
+    """
+    去掉内容重复的片段（忽略大小写与空白差异），保留先出现的一个。
+    在检索之后调用一次，make_prompt 与引用来源列表使用同一份结果，片段编号才能对应。
+    """
+    seen = set()
+    uniq = []
+    for d in docs:
+        text = d.page_content if isinstance(d, Document) else _doc_fields(d)[0]
+        key = hashlib.blake2b(" ".join(text.lower().split()).encode("utf-8"), digest_size=16).digest()
+        if key in seen:
+            continue
+        seen.add(key)
+        uniq.append(d)
+    return uniq
+
 def make_prompt(query: str, docs):
-    parts = []
-    for i, d in enumerate(docs, start=1):
-        text = getattr(d, "page_content", getattr(d, "content", str(d)))
-        src = d.metadata.get("source", "unknown") if hasattr(d, "metadata") else "unknown"
-        parts.append(f"[片段 {i} | 来源: {src}]\n{text}\n")
-    context = "\n".join(parts)
-    prompt = (
-        "下面是检索到的知识片段（仅供参考）。请**仅基于这些片段**回答用户问题，"
-        "如果片段中没有相关信息，请回答“我不知道”。\n\n"
-        f"{context}\n用户问题：{query}\n\n请给出简洁准确的回答，并在末尾列出引用来源。"
-    )
-    return prompt
+    # 服务端会自动缓存与历史请求相同的 prompt 前缀（省去重复的 prefill 计算），
+    # 因此固定说明放在最前面、问题放在最后。
+    # 片段保持传入顺序（按相关度），编号与调用方列出的引用来源一一对应。
+    # 重复片段需由调用方事先用 dedupe_docs 去掉。
+    parts = [
+        f"[片段 {i} | 来源: {src}]\n{text}\n"
+        for i, (text, src) in enumerate(map(_doc_fields, docs), start=1)
+    ]
+    return "".join((_PROMPT_HEADER, "\n".join(parts), _PROMPT_FOOTER_TMPL.format(query=query)))
 
 def qwen_chat(prompt, model="qwen3-max", temperature=0.1):
-    client = OpenAI(api_key=os.environ.get("QWEN_API_KEY"),
-                    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1")
-    completion = client.chat.completions.create(
+    def _call():
+        completion = get_client().chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that must only answer based on provided context."},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=temperature,
+            max_tokens=512,
+        )
+        return completion.choices[0].message.content
+    # 相同模型、温度与 prompt 的回答直接从磁盘缓存返回
+    return cached_call("answers", f"{model}|{temperature}", prompt, _call)
+
+def qwen_chat_stream(prompt, model="qwen3-max", temperature=0.1) -> Iterator[str]:
+    """
+    qwen_chat 的流式版本：边生成边返回文本片段，首个片段通常在几百毫秒内到达。
+    生成结束后把完整回答写入回答缓存；命中缓存时一次性返回整段回答。
+    """
+    cache = get_cache("answers")
+    key = make_key(f"{model}|{temperature}", prompt)
+    answer = cache.get(key)
+    if answer is not None:
+        yield answer
+        return
+    stream = get_client().chat.completions.create(
         model=model,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that must only answer based on provided context."},
@@ -48,8 +151,93 @@ def qwen_chat(prompt, model="qwen3-max", temperature=0.1):
         ],
         temperature=temperature,
         max_tokens=512,
+        stream=True,
     )
-    return completion.choices[0].message.content
+    parts = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        text = chunk.choices[0].delta.content or ""
+        if text:
+            parts.append(text)
+            yield text
+    cache.set(key, "".join(parts), expire=CACHE_TTL)
+
+async def aqwen_chat(prompt, model="qwen3-max", temperature=0.1):
+    """qwen_chat 的异步版本（共用同一份回答缓存），可被取消"""
+    cache = get_cache("answers")
+    key = make_key(f"{model}|{temperature}", prompt)
+    answer = cache.get(key)
+    if answer is not None:
+        return answer
+    # 异步客户端与事件循环绑定，因此每次调用单独创建并在结束时关闭
+    async with AsyncOpenAI(api_key=os.environ.get("QWEN_API_KEY"), base_url=QWEN_BASE_URL) as client:
+        completion = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that must only answer based on provided context."},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=temperature,
+            max_tokens=512,
+        )
+    answer = completion.choices[0].message.content
+    cache.set(key, answer, expire=CACHE_TTL)
+    return answer
+
+async def speculative_rag_answer(query, vect, k, model="qwen3-max", temperature=0.1):
+    """
+    流水线 RAG：先用 top-1 片段发起草稿回答，同时完成 top-k 检索，
+    检索时间被隐藏在生成时间里。
+    
+    top-k 结果的第 1 名仍是同一片段、且其余片段明显不如它相关（距离差超过 SPECULATIVE_MARGIN）时
+    保留草稿；否则取消草稿，用全部 top-k 片段重新生成。
+    
+    Returns:
+        (answer, docs, kept): 回答文本、生成回答所用的片段，以及是否保留了草稿
+    """
+    query_vec = await asyncio.to_thread(get_embeddings().embed_query, query)
+    top1 = await asyncio.to_thread(vect.similarity_search_by_vector_with_relevance_scores, query_vec, 1)
+    if not top1:
+        return None, [], False
+    draft = asyncio.create_task(aqwen_chat(make_prompt(query, [top1[0][0]]), model, temperature))
+    
+    scored = await asyncio.to_thread(vect.similarity_search_by_vector_with_relevance_scores, query_vec, k)
+    (best, best_dist) = scored[0]
+    same_top = best.page_content == top1[0][0].page_content
+    if same_top and (len(scored) == 1 or scored[1][1] - best_dist > SPECULATIVE_MARGIN):
+        return await draft, [best], True
+    
+    draft.cancel()
+    # 等待草稿任务真正结束，草稿若已出错也在这里取走异常，避免退出时报 "Task exception was never retrieved"
+    with contextlib.suppress(asyncio.CancelledError, Exception):
+        await draft
+    docs = dedupe_docs([d for d, _ in scored])
+    answer = await aqwen_chat(make_prompt(query, docs), model, temperature)
+    return answer, docs, False
+
+def rag_answer_stream(query, query_vec, prompt, scope, model="qwen3-max", temperature=0.1):
+    """
+    带语义缓存的流式 RAG 回答：与历史问题足够相似时直接复用历史回答，否则流式调用 LLM，结束后写入缓存
+    
+    Args:
+        scope: 语义缓存的作用域，见 semantic_scope()
+    
+    Returns:
+        (tokens, hit): 回答文本片段的迭代器，以及是否命中语义缓存
+    """
+    semantic_cache = get_semantic_cache(scope)
+    answer = semantic_cache.lookup(query_vec)
+    if answer is not None:
+        return iter([answer]), True
+    
+    def _generate():
+        parts = []
+        for text in qwen_chat_stream(prompt, model=model, temperature=temperature):
+            parts.append(text)
+            yield text
+        semantic_cache.add(make_key(model, query), query_vec, "".join(parts))
+    return _generate(), False
 
 def main():
     import os
@@ -60,6 +248,7 @@ def main():
     parser.add_argument("--persist_dir", "-p", default="chroma_db", help="向量数据库路径")
     parser.add_argument("--k", type=int, default=3, help="检索top-k数量")
     parser.add_argument("--query", "-q", default="如何更换电池?", help="查询问题")
+    parser.add_argument("--quantized", action="store_true", help="使用 int8 / 二值量化索引检索")
     args = parser.parse_args()
     
     # 创建输出目录
@@ -85,9 +274,9 @@ def main():
     print(f"\n📂 正在加载向量数据库...")
     print(f"   数据库路径: {args.persist_dir}")
     
-    emb = QwenEmbeddings()
-    vect = Chroma(persist_directory=args.persist_dir, embedding_function=emb)
-    retriever = vect.as_retriever(search_kwargs={"k": args.k})
+    emb = get_embeddings()
+    vect = get_vectorstore(args.persist_dir)
+    retriever = get_retriever(args.persist_dir, args.k)
     
     # 获取数据库统计信息
     try:
@@ -104,7 +293,14 @@ def main():
     print(f"\n🔍 正在检索相关文档...")
     
     start_time = datetime.now()
-    docs = retriever.invoke(query)
+    docs = quantized_retrieve(query, args.persist_dir, args.k) if args.quantized else None
+    used_quantized = docs is not None
+    if docs is None:
+        if args.quantized:
+            print("⚠️  未找到量化索引，改用 Chroma 检索（可运行 store_manager.py --quantize 生成）")
+        docs = retriever.invoke(query)
+    # 重复片段只会多占 token、稀释注意力；去重后的列表同时用于 prompt 与引用来源
+    docs = dedupe_docs(docs)
     retrieval_time = (datetime.now() - start_time).total_seconds()
     
     print(f"✅ 检索完成！")
@@ -141,18 +337,33 @@ def main():
     print(f"   - Temperature: 0.1 (低温度，保证准确性)")
     
     start_time = datetime.now()
-    answer = qwen_chat(prompt, model="qwen3-max", temperature=0.1)
-    generation_time = (datetime.now() - start_time).total_seconds()
+    query_vec = emb.embed_query(query)  # 检索时已缓存，这里不会再次请求接口
+    scope = semantic_scope(args.persist_dir, args.k, used_quantized)
+    tokens, cache_hit = rag_answer_stream(query, query_vec, prompt, scope, model="qwen3-max", temperature=0.1)
     
-    print(f"✅ 回答生成完成！")
-    print(f"   - 生成耗时: {generation_time:.2f} 秒")
+    if cache_hit:
+        print(f"⚡ 命中语义缓存，直接复用相似问题的回答")
     
-    # 输出结果
+    # 流式输出结果：边生成边打印
     print(f"\n{'='*70}")
     print("➡️  RAG回答:")
     print(f"{'='*70}")
-    print(answer)
+    answer_parts = []
+    first_token_time = None
+    for text in tokens:
+        if first_token_time is None:
+            first_token_time = (datetime.now() - start_time).total_seconds()
+        print(text, end="", flush=True)
+        answer_parts.append(text)
+    print()
     print(f"{'='*70}")
+    answer = "".join(answer_parts)
+    generation_time = (datetime.now() - start_time).total_seconds()
+    
+    print(f"✅ 回答生成完成！")
+    if first_token_time is not None:
+        print(f"   - 首字耗时: {first_token_time:.2f} 秒")
+    print(f"   - 生成耗时: {generation_time:.2f} 秒")
     
     # 输出引用来源
     print(f"\n📚 引用来源:")
@@ -8,25 +8,30 @@ RAG vs LLM 对比演示
 
 import os
 import sys
+import asyncio
+import argparse
+import logging
 from pathlib import Path
 from datetime import datetime
 
 # 导入模块
 try:
-    from llm_with_rag import qwen_chat, make_prompt
-    from store_manager import QwenEmbeddings
-    from langchain_community.vectorstores import Chroma
+    from llm_with_rag import (qwen_chat, aqwen_chat, make_prompt, dedupe_docs, rag_answer_stream, semantic_scope,
+                              get_embeddings, get_retriever, get_vectorstore, speculative_rag_answer)
 except ImportError as e:
     print(f"❌ 导入错误: {e}")
     print("💡 提示：请确保已安装所有依赖")
     print("   运行: uv sync")
     sys.exit(1)
 
+logger = logging.getLogger(__name__)
+
 # 配置
 QWEN_MODEL = "qwen3-max"
 TEST_QUESTION = "如何更换电池?"
 PERSIST_DIR = "chroma_db"
 TOP_K = 3
+SPECULATIVE = False  # True: 检索 top-k 的同时先用 top-1 片段生成草稿回答（流水线模式）
 
 def print_section(title, char="=", width=70):
     """打印分隔线"""
@@ -34,11 +39,21 @@ def print_section(title, char="=", width=70):
     print(f"{title:^{width}}")
     print(f"{char * width}\n")
 
-def test_llm_only(question):
-    """测试纯LLM回答"""
+def _print_llm_header(question):
     print("🤖 [方式1] 纯LLM回答（无知识库）")
     print("-" * 70)
     print(f"问题: {question}\n")
+
+def _print_llm_answer(answer, duration):
+    print(f"⏱️  耗时: {duration:.2f} 秒\n")
+    print("回答:")
+    print("-" * 70)
+    print(answer)
+    print("-" * 70)
+
+def test_llm_only(question):
+    """测试纯LLM回答"""
+    _print_llm_header(question)
     
     try:
         start_time = datetime.now()
@@ -46,11 +61,7 @@ def test_llm_only(question):
         end_time = datetime.now()
         duration = (end_time - start_time).total_seconds()
         
-        print(f"⏱️  耗时: {duration:.2f} 秒\n")
-        print("回答:")
-        print("-" * 70)
-        print(answer)
-        print("-" * 70)
+        _print_llm_answer(answer, duration)
         
         return {
             "answer": answer,
@@ -59,10 +70,35 @@ def test_llm_only(question):
         }
     except Exception as e:
         print(f"❌ 错误: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.debug("测试失败", exc_info=True)
         return None
 
+async def atest_llm_only(question):
+    """
+    test_llm_only 的异步版本：只发起请求并计时，结果由调用方打印
+    （RAG 回答是流式打印的，这里不打印以免两者输出交错）
+    """
+    try:
+        start_time = datetime.now()
+        answer = await aqwen_chat(question, model=QWEN_MODEL, temperature=0.1)
+        duration = (datetime.now() - start_time).total_seconds()
+        return {
+            "answer": answer,
+            "duration": duration,
+            "sources": []
+        }
+    except Exception as e:
+        print(f"❌ 纯LLM回答出错: {e}")
+        logger.debug("纯LLM测试失败", exc_info=True)
+        return None
+
+async def run_concurrently(question):
+    """纯LLM请求与 RAG（检索 + 生成）同时进行，总耗时约为两者中较慢的一个"""
+    return await asyncio.gather(
+        atest_llm_only(question),
+        asyncio.to_thread(test_rag, question),  # 检索与同步 API 调用放到工作线程，不阻塞事件循环
+    )
+
 def test_rag(question):
     """测试RAG回答"""
     print("\n📚 [方式2] RAG回答（基于知识库）")
@@ -76,14 +112,16 @@ def test_rag(question):
             print("💡 提示：请先运行 store_manager.py 构建向量数据库")
             return None
         
-        emb = QwenEmbeddings()
-        vect = Chroma(persist_directory=PERSIST_DIR, embedding_function=emb)
-        retriever = vect.as_retriever(search_kwargs={"k": TOP_K})
+        if SPECULATIVE:
+            return _test_rag_speculative(question)
+        
+        emb = get_embeddings()
+        retriever = get_retriever(PERSIST_DIR, TOP_K)
         
         # 检索
         print(f"🔍 正在检索（top_k={TOP_K}）...")
         start_time = datetime.now()
-        docs = retriever.invoke(question)
+        docs = dedupe_docs(retriever.invoke(question))  # 去重后的列表同时用于 prompt 与引用来源
         retrieval_time = (datetime.now() - start_time).total_seconds()
         
         print(f"✅ 检索完成（耗时: {retrieval_time:.3f}秒，检索到{len(docs)}个片段）")
@@ -97,16 +135,32 @@ def test_rag(question):
         print(f"🤖 正在生成回答...")
         
         start_time = datetime.now()
-        answer = qwen_chat(prompt, model=QWEN_MODEL, temperature=0.1)
-        generation_time = (datetime.now() - start_time).total_seconds()
-        
-        total_time = retrieval_time + generation_time
+        query_vec = emb.embed_query(question)  # 检索时已缓存，这里不会再次请求接口
+        tokens, cache_hit = rag_answer_stream(question, query_vec, prompt, semantic_scope(PERSIST_DIR, TOP_K),
+                                              model=QWEN_MODEL, temperature=0.1)
+        if cache_hit:
+            print("⚡ 命中语义缓存，直接复用相似问题的回答")
         
-        print(f"⏱️  总耗时: {total_time:.2f} 秒（检索: {retrieval_time:.3f}秒 + 生成: {generation_time:.2f}秒）\n")
+        # 流式输出：边生成边打印
         print("回答:")
         print("-" * 70)
-        print(answer)
+        answer_parts = []
+        first_token_time = None
+        for text in tokens:
+            if first_token_time is None:
+                first_token_time = (datetime.now() - start_time).total_seconds()
+            print(text, end="", flush=True)
+            answer_parts.append(text)
+        print()
         print("-" * 70)
+        answer = "".join(answer_parts)
+        generation_time = (datetime.now() - start_time).total_seconds()
+        
+        total_time = retrieval_time + generation_time
+        
+        print(f"⏱️  总耗时: {total_time:.2f} 秒（检索: {retrieval_time:.3f}秒 + 生成: {generation_time:.2f}秒）")
+        if first_token_time is not None:
+            print(f"⚡ 首字耗时: {first_token_time:.2f} 秒")
         
         # 提取来源
         sources = []
@@ -128,9 +182,39 @@ def test_rag(question):
         }
     except Exception as e:
         print(f"❌ 错误: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.debug("测试失败", exc_info=True)
+        return None
+
+def _test_rag_speculative(question):
+    """流水线模式：检索与生成重叠执行"""
+    print(f"🔍 正在检索并生成（流水线模式，top_k={TOP_K}）...")
+    start_time = datetime.now()
+    answer, docs, kept = asyncio.run(
+        speculative_rag_answer(question, get_vectorstore(PERSIST_DIR), TOP_K, model=QWEN_MODEL, temperature=0.1)
+    )
+    total_time = (datetime.now() - start_time).total_seconds()
+    
+    if not docs:
+        print("⚠️  警告：未检索到相关文档")
         return None
+    
+    print("✅ 保留 top-1 草稿回答" if kept else f"🔁 top-k 结果变化，已用 {len(docs)} 个片段重新生成")
+    print(f"⏱️  总耗时: {total_time:.2f} 秒\n")
+    print("回答:")
+    print("-" * 70)
+    print(answer)
+    print("-" * 70)
+    
+    sources = [f"{d.metadata.get('source', 'unknown')} 片段 {i}" for i, d in enumerate(docs, start=1)]
+    print("\n📚 引用来源:")
+    for src in sources:
+        print(f"  - {src}")
+    
+    return {
+        "answer": answer,
+        "duration": total_time,
+        "sources": sources
+    }
 
 def compare_results(llm_result, rag_result):
     """对比两种方式的结果"""
@@ -210,6 +294,11 @@ def compare_results(llm_result, rag_result):
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="RAG vs LLM 对比演示")
+    parser.add_argument("--interactive", "-i", action="store_true",
+                        help="逐步演示：先纯LLM、按回车后再RAG（两次请求串行执行）")
+    args = parser.parse_args()
+    
     # 检查环境变量
     if not os.environ.get("QWEN_API_KEY"):
         print("❌ 错误: 请设置环境变量 QWEN_API_KEY")
@@ -222,16 +311,26 @@ def main():
     print(f"测试问题: {TEST_QUESTION}")
     print(f"向量数据库: {PERSIST_DIR}")
     
-    # 测试纯LLM
-    print_section("第一部分：纯LLM回答", "-")
-    llm_result = test_llm_only(TEST_QUESTION)
-    
-    # 等待用户查看
-    input("\n按 Enter 键继续查看RAG回答...")
-    
-    # 测试RAG
-    print_section("第二部分：RAG回答", "-")
-    rag_result = test_rag(TEST_QUESTION)
+    if args.interactive:
+        # 测试纯LLM
+        print_section("第一部分：纯LLM回答", "-")
+        llm_result = test_llm_only(TEST_QUESTION)
+        
+        # 等待用户查看
+        input("\n按 Enter 键继续查看RAG回答...")
+        
+        # 测试RAG
+        print_section("第二部分：RAG回答", "-")
+        rag_result = test_rag(TEST_QUESTION)
+    else:
+        # 两种方式并发执行，先流式展示RAG回答，再展示同时完成的纯LLM回答
+        print_section("第一部分：RAG回答（纯LLM请求同时进行）", "-")
+        llm_result, rag_result = asyncio.run(run_concurrently(TEST_QUESTION))
+        
+        print_section("第二部分：纯LLM回答", "-")
+        _print_llm_header(TEST_QUESTION)
+        if llm_result:
+            _print_llm_answer(llm_result["answer"], llm_result["duration"])
     
     # 对比结果
     compare_results(llm_result, rag_result)
@@ -239,6 +338,7 @@ def main():
     print("\n✅ 演示完成！")
     print("\n💡 提示:")
     print("   - 可以修改 TEST_QUESTION 测试其他问题")
+    print("   - 运行 python main.py --interactive 逐步查看两种回答")
     print("   - 可以修改 knowledge/ 目录下的文档添加更多知识")
     print("   - 运行 python llm_with_rag.py 单独测试RAG系统")
     print("   - 运行 python llm_with_rag.py --query '你的问题' 测试自定义问题")
@@ -251,7 +351,6 @@ if __name__ == "__main__":
         sys.exit(0)
     except Exception as e:
         print(f"\n❌ 未预期的错误: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error("未预期的错误", exc_info=True)
         sys.exit(1)
 
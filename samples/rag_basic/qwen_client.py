@@ -0,0 +1,36 @@
+"""
+千问接口的共享客户端：所有 Embedding 与对话请求复用同一个 httpx 连接池。
+
+说明：
+  - 开启 HTTP/2 与 keep-alive，连接建立后可被后续请求复用，省去每次请求的 TCP + TLS 握手
+  - 客户端在首次使用时创建（此时才读取 QWEN_API_KEY），进程退出时自动关闭连接池
+"""
+
+import os
+import atexit
+from functools import lru_cache
+
+import httpx
+from openai import OpenAI
+
+QWEN_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+@lru_cache(maxsize=1)
+def get_http_client():
+    """进程内共享的 httpx 连接池"""
+    client = httpx.Client(
+        http2=True,
+        timeout=60,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    )
+    atexit.register(client.close)
+    return client
+
+@lru_cache(maxsize=1)
+def get_client():
+    """进程内共享的 OpenAI 客户端（底层使用 get_http_client 的连接池）"""
+    return OpenAI(
+        api_key=os.environ.get("QWEN_API_KEY"),
+        base_url=QWEN_BASE_URL,
+        http_client=get_http_client(),
+    )
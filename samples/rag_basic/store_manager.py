@@ -2,62 +2,133 @@
 把 chunks.json 写入 Chroma 向量数据库。
 用法：
   python store_manager.py --chunks chunks.json --persist_dir chroma_db
+  python store_manager.py --hnsw_m 32 --construction_ef 200 --search_ef 80
+  python store_manager.py --quantize     # 额外保存 int8 / 二值量化索引
+  python store_manager.py --rebuild      # 删除旧库后全量重建
 说明：
-  - 本示例用 Chroma.from_texts (自动调用 embeddings) 来构建向量库，简单易懂。
-  - 如果 chroma_db 目录存在，会覆盖/更新（取决于 chroma 版本）。
+  - 使用 chromadb.PersistentClient 写入，数据自动持久化，无需调用 persist()。
+  - 索引为 HNSW（余弦距离），M / ef 参数可通过命令行调整。
+  - 默认增量更新：按切片 id 与内容哈希比对，只对新增/修改的切片调用 Embedding 接口，
+    chunks.json 中已不存在的切片会从库中删除。
 """
 
-import os
 import json
-from openai import OpenAI
+import hashlib
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from openai import RateLimitError
 from langchain_community.vectorstores import Chroma
 from pathlib import Path
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+from cache_manager import cached_call, invalidate
+from qwen_client import get_client
+from embedder import hamming_search, int8_search, quantize_binary, quantize_int8
 
 # 常量定义
 EMBED_MODEL = "text-embedding-v4"
-DEFAULT_TOP_RERANK = 10
+EMBED_BATCH_SIZE = 10           # 单次请求的文本条数（text-embedding-v4 接口上限为 10）
+EMBED_WORKERS = 8               # 并发请求的线程数
+COLLECTION_NAME = "rag"         # 向量库集合名（检索端需使用同一名称）
+INSERT_BATCH_SIZE = 1000        # 每批写入 Chroma 的切片数
+# HNSW 索引默认参数：M 越大召回越高、内存越大；ef 越大越准、越慢
+HNSW_M = 32
+HNSW_CONSTRUCTION_EF = 200
+HNSW_SEARCH_EF = 80
+QUANTIZED_FILE = "quantized.npz"  # 量化索引文件名（保存在向量库目录下）
+QUANTIZED_CANDIDATES = 50         # 二值粗排保留的候选数，再用 int8 精排
 
 class QwenEmbeddings:
     """阿里云千问嵌入模型包装类"""
     def __init__(self):
-        self.client = OpenAI(
-            api_key=os.environ.get("QWEN_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-        )
+        # 与对话请求共用同一个连接池
+        self.client = get_client()
+
+    @retry(
+        retry=retry_if_exception_type(RateLimitError),
+        wait=wait_exponential(multiplier=1, max=30),
+        stop=stop_after_attempt(5),
+        reraise=True,
+    )
+    def _embed_batch(self, batch):
+        """嵌入单个批次，触发限流时指数退避重试"""
+        res = self.client.embeddings.create(model=EMBED_MODEL, input=batch)
+        return [item.embedding for item in res.data]
 
     def embed_documents(self, texts):
         """对文档列表进行嵌入"""
-        # 检查批量大小，如果超过10个则分批处理
-        if len(texts) > DEFAULT_TOP_RERANK:
-            embeddings = []
-            for i in range(0, len(texts), DEFAULT_TOP_RERANK):
-                batch = texts[i:i+DEFAULT_TOP_RERANK]
-                res = self.client.embeddings.create(model=EMBED_MODEL, input=batch)
-                embeddings.extend([item.embedding for item in res.data])
-        else:
-            # 调用 embeddings API
-            res = self.client.embeddings.create(model=EMBED_MODEL, input=texts)
-            embeddings = [item.embedding for item in res.data]
+        # 按接口上限分批，多个批次并发请求；map 按提交顺序返回，结果与输入顺序一致
+        batches = [texts[i:i+EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+        if len(batches) <= 1:
+            return self._embed_batch(batches[0]) if batches else []
         
-        return embeddings
+        with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as ex:
+            results = list(ex.map(self._embed_batch, batches))
+        return [vec for batch in results for vec in batch]
 
     def embed_query(self, text):
-        """对单个查询进行嵌入"""
-        res = self.client.embeddings.create(model=EMBED_MODEL, input=[text])
-        return res.data[0].embedding
+        """对单个查询进行嵌入（结果缓存到磁盘，重复提问不再请求接口）"""
+        def _call():
+            res = self.client.embeddings.create(model=EMBED_MODEL, input=[text])
+            return res.data[0].embedding
+        return cached_call("embeddings", EMBED_MODEL, text, _call)
+
+def content_hash(text):
+    """切片内容哈希，用于增量更新时判断切片是否修改"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def save_quantized_index(persist_dir, ids, vectors):
+    """把向量量化为 int8（每条向量一个 scale）和二值编码，保存到向量库目录"""
+    q, scale = quantize_int8(vectors, per_vector=True)
+    bits = quantize_binary(vectors)
+    path = Path(persist_dir) / QUANTIZED_FILE
+    np.savez(path, ids=np.array(ids), q=q, scale=scale, bits=bits)
+    return path, q.nbytes + scale.nbytes + bits.nbytes
+
+def load_quantized_index(persist_dir):
+    """加载量化索引，不存在时返回 None"""
+    path = Path(persist_dir) / QUANTIZED_FILE
+    if not path.exists():
+        return None
+    with np.load(path) as data:
+        return {name: data[name] for name in ("ids", "q", "scale", "bits")}
+
+def quantized_search(index, query_vec, k=3, candidates=QUANTIZED_CANDIDATES):
+    """
+    两阶段检索：先在二值编码上按汉明距离粗排出候选，再用 int8 内积精排出 top-k。
+    返回：切片 id 列表，按相似度从高到低排序
+    """
+    query_bits = quantize_binary([query_vec])[0]
+    cand, _ = hamming_search(index["bits"], query_bits, k=max(k, candidates))
+    top, _ = int8_search(index["q"], index["scale"], query_vec, k=k, candidates=cand)
+    return [str(i) for i in index["ids"][top]]
 
 def main():
     import os
     import shutil
+    import chromadb
     from pathlib import Path
     from datetime import datetime
     
+    parser = argparse.ArgumentParser(description="构建向量数据库")
+    parser.add_argument("--chunks", default=None, help="切片文件路径（默认 output/chunks.json 或 chunks.json）")
+    parser.add_argument("--persist_dir", "-p", default="chroma_db", help="向量数据库路径")
+    parser.add_argument("--hnsw_m", type=int, default=HNSW_M, help="HNSW 每个节点的邻居数 M")
+    parser.add_argument("--construction_ef", type=int, default=HNSW_CONSTRUCTION_EF, help="HNSW 建索引时的候选队列长度")
+    parser.add_argument("--search_ef", type=int, default=HNSW_SEARCH_EF, help="HNSW 检索时的候选队列长度")
+    parser.add_argument("--quantize", action="store_true", help="额外保存 int8 / 二值量化索引")
+    parser.add_argument("--rebuild", action="store_true", help="删除已有向量数据库并全量重建")
+    args = parser.parse_args()
+    
     # 配置参数
-    chunks_file = Path("output/chunks.json")
-    if not chunks_file.exists():
-        chunks_file = Path("chunks.json")
+    if args.chunks:
+        chunks_file = Path(args.chunks)
+    else:
+        chunks_file = Path("output/chunks.json")
+        if not chunks_file.exists():
+            chunks_file = Path("chunks.json")
     
-    persist_dir = "chroma_db"
+    persist_dir = args.persist_dir
     
     print("=" * 70)
     print("💾 向量数据库构建")
@@ -77,12 +148,11 @@ def main():
     # 检查数据库是否已存在
     if os.path.exists(persist_dir):
         print(f"\n⚠️  检测到已有向量数据库: {persist_dir}")
-        response = input("   是否删除并重建？(y/n): ").strip().lower()
-        if response == 'y':
+        if args.rebuild:
             shutil.rmtree(persist_dir)
-            print(f"   ✅ 已删除旧数据库")
+            print(f"   ✅ 已删除旧数据库，将全量重建")
         else:
-            print(f"   ⚠️  保留旧数据库，将更新数据")
+            print(f"   ⚠️  保留旧数据库，只更新有变化的切片（全量重建请加 --rebuild）")
     
     # 加载切片
     print(f"\n📖 正在加载切片文件...")
@@ -92,7 +162,9 @@ def main():
         chunks = json.load(f)
     
     texts = [c["text"] for c in chunks]
-    metadatas = [{"id": c["id"], "source": c["source"]} for c in chunks]
+    metadatas = [{"id": c["id"], "source": c["source"], "hash": content_hash(c["text"])} for c in chunks]
+    # 固定 id：重复写入时覆盖同一切片，而不是产生重复向量
+    ids = [f"{c['source']}-{c['id']}" for c in chunks]
     
     print(f"✅ 加载成功")
     print(f"   - 切片数量: {len(texts)} 个")
@@ -101,31 +173,72 @@ def main():
     print(f"\n🔨 正在构建向量数据库...")
     print(f"   - Embedding模型: text-embedding-v4")
     print(f"   - 数据库路径: {persist_dir}")
+    print(f"   - HNSW参数: M={args.hnsw_m}, construction_ef={args.construction_ef}, search_ef={args.search_ef}")
     print(f"   - 处理中，请稍候...")
     
     start_time = datetime.now()
     emb = QwenEmbeddings()
-    vect = Chroma.from_texts(
-        texts=texts, 
-        embedding=emb, 
-        metadatas=metadatas, 
-        persist_directory=persist_dir
+    client = chromadb.PersistentClient(path=persist_dir)
+    vect = Chroma(
+        client=client,
+        collection_name=COLLECTION_NAME,
+        embedding_function=emb,
+        collection_metadata={
+            "hnsw:space": "cosine",
+            "hnsw:M": args.hnsw_m,
+            "hnsw:construction_ef": args.construction_ef,
+            "hnsw:search_ef": args.search_ef,
+        },
     )
+    collection = vect._collection
     
-    # 持久化
-    try:
-        vect.persist()
-        end_time = datetime.now()
-        duration = (end_time - start_time).total_seconds()
-        
-        print(f"✅ 向量数据库构建完成！")
-        print(f"   - 耗时: {duration:.2f} 秒")
-        print(f"   - 存储路径: {persist_dir}")
-        print(f"   - 向量数量: {vect._collection.count() if hasattr(vect, '_collection') else len(texts)}")
-        
-    except Exception as e:
-        print(f"⚠️  持久化警告: {e}")
-        print(f"   数据库已构建，但持久化可能失败")
+    # 与库中已有切片比对：只有新增或内容变化的切片需要重新计算向量
+    stored = collection.get(include=["metadatas"])
+    stored_hash = {i: (m or {}).get("hash") for i, m in zip(stored["ids"], stored["metadatas"])}
+    changed = [i for i, meta in enumerate(metadatas) if stored_hash.get(ids[i]) != meta["hash"]]
+    current = set(ids)
+    stale = [i for i in stored_hash if i not in current]
+    print(f"   - 新增/修改: {len(changed)} 个，未变化: {len(ids) - len(changed)} 个，待删除: {len(stale)} 个")
+    
+    # 先统一计算向量，再分批写入，避免超过 Chroma 单次写入的条数上限
+    vectors = emb.embed_documents([texts[i] for i in changed])
+    for start in range(0, len(changed), INSERT_BATCH_SIZE):
+        batch = changed[start:start+INSERT_BATCH_SIZE]
+        collection.upsert(
+            ids=[ids[i] for i in batch],
+            embeddings=vectors[start:start+INSERT_BATCH_SIZE],
+            metadatas=[metadatas[i] for i in batch],
+            documents=[texts[i] for i in batch],
+        )
+    for start in range(0, len(stale), INSERT_BATCH_SIZE):
+        collection.delete(ids=stale[start:start+INSERT_BATCH_SIZE])
+    
+    # 知识库有变化时清空问答缓存，避免返回基于旧内容的回答
+    if changed or stale:
+        invalidate()
+    
+    # PersistentClient 写入即持久化
+    end_time = datetime.now()
+    duration = (end_time - start_time).total_seconds()
+    
+    print(f"✅ 向量数据库构建完成！")
+    print(f"   - 耗时: {duration:.2f} 秒")
+    print(f"   - 存储路径: {persist_dir}")
+    print(f"   - 向量数量: {collection.count()}")
+    
+    # 已有量化索引且切片有变化时也要重新生成，否则 --quantized 检索会漏掉新切片、返回已删除的切片
+    quantized_path = Path(persist_dir) / QUANTIZED_FILE
+    refresh_quantized = quantized_path.exists() and (changed or stale)
+    if (args.quantize or refresh_quantized) and collection.count() == 0:
+        quantized_path.unlink(missing_ok=True)
+    elif args.quantize or refresh_quantized:
+        # 量化索引覆盖全部切片（包括本次未重新计算的），从库中读回全部向量
+        stored = collection.get(include=["embeddings"])
+        all_vectors = np.asarray(stored["embeddings"], dtype=np.float32)
+        path, nbytes = save_quantized_index(persist_dir, stored["ids"], all_vectors)
+        fp32_size = all_vectors.nbytes
+        print(f"\n📦 量化索引已保存: {path}")
+        print(f"   - float32: {fp32_size / 1024:.1f} KB -> 量化后: {nbytes / 1024:.1f} KB")
     
     print(f"\n💡 提示：")
     print(f"   - 向量数据库已保存，可以用于检索")